@@ -1,22 +1,25 @@
-import base64
-import io
+import os
 from datetime import datetime
 from typing import List, Optional
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body, Query
+import anyio
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
 import numpy as np
-from PIL import Image
 
 from models.image_processor import WhiskyBottleProcessor
+from models.batching import BatchedFeatureExtractor
 from utils.database import BottleDatabase
+from utils.cache import FeatureCache
+from utils.encoding import decode_base64_body
 
 app = FastAPI(
     title="Whisky Bottle Recognition API",
     description="API for identifying whisky bottles using computer vision",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS for mobile app access
@@ -31,16 +34,50 @@ app.add_middleware(
 # Initialize models on startup
 bottle_processor = None
 bottle_db = None
+extractor = None
+feature_cache = FeatureCache(maxsize=4096)
 
 @app.on_event("startup")
 async def startup_event():
-    global bottle_processor, bottle_db
+    global bottle_processor, bottle_db, extractor
     # Initialize image processor with CLIP model
     bottle_processor = WhiskyBottleProcessor()
+    # On GPU, batch concurrent requests into a single CLIP forward pass;
+    # on CPU, requests run in the threadpool across multiple workers
+    if bottle_processor.device == "cuda":
+        extractor = BatchedFeatureExtractor(bottle_processor, max_batch=bottle_processor.max_batch_size)
+        extractor.start()
     # Initialize vector database
-    bottle_db = BottleDatabase()
-    # Load precomputed bottle embeddings
-    bottle_db.load_embeddings()
+    # INDEX_TYPE is only used when no saved index exists and one is built at startup
+    bottle_db = BottleDatabase(index_type=os.environ.get("INDEX_TYPE", "auto"))
+    # Load precomputed bottle embeddings, memory-mapped so that all
+    # workers share a single copy
+    bottle_db.load_embeddings(mmap=True)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if extractor is not None:
+        await extractor.stop()
+
+def decode_and_extract_features(contents):
+    """Decode image bytes and extract CLIP features in the calling thread."""
+    return bottle_processor.extract_features(bottle_processor.decode_image(contents))
+
+async def extract_image_features(contents):
+    """Decode image bytes and extract CLIP features without blocking the event loop."""
+    if extractor is not None:
+        image = await anyio.to_thread.run_sync(bottle_processor.decode_image, contents)
+        return await extractor.submit(image)
+    return await anyio.to_thread.run_sync(decode_and_extract_features, contents)
+
+async def extract_upload_features(contents):
+    """Extract CLIP features for raw image bytes, reusing them for repeated uploads."""
+    key = feature_cache.key(contents)
+    features = feature_cache.get(key)
+    if features is None:
+        features = await extract_image_features(contents)
+        feature_cache.put(key, features)
+    return features
 
 class BottleMatch(BaseModel):
     id: str
@@ -72,13 +109,14 @@ async def identify_bottle(
     try:
         # Read and validate image file
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
         
-        # Extract features using CLIP model
-        features = bottle_processor.extract_features(image)
+        # Extract features using CLIP model (cached by image content)
+        features = await extract_upload_features(contents)
         
         # Find matching bottles in the database with confidence threshold
-        matches = bottle_db.find_matches(features, top_k=3, confidence_threshold=confidence_threshold)
+        matches = await anyio.to_thread.run_sync(
+            bottle_db.find_matches, features, 3, confidence_threshold
+        )
         
         # Calculate processing time
         processing_time = (datetime.now() - start_time).total_seconds() * 1000
@@ -90,29 +128,53 @@ async def identify_bottle(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/identify_base64")
+@app.post(
+    "/api/identify_base64",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["base64_image"],
+                        "properties": {"base64_image": {"type": "string"}}
+                    }
+                },
+                "text/plain": {"schema": {"type": "string"}}
+            }
+        }
+    }
+)
 async def identify_bottle_base64(
-    base64_image: str = Body(..., embed=True),
+    request: Request,
     confidence_threshold: float = Query(0.5, ge=0.0, le=1.0, description="Minimum confidence score for matches")
 ):
     """
     Identify a whisky bottle from a base64-encoded image.
     Useful for direct integration with React Native.
     
+    The body is either `{"base64_image": "..."}` or the bare base64 text,
+    optionally as a `data:` URI.
+    
     - **confidence_threshold**: Minimum confidence threshold (0.0-1.0) for a match to be included
     """
     start_time = datetime.now()
     
+    # Decode base64 image; a malformed body is a client error
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(base64_image)
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Extract features using CLIP model
-        features = bottle_processor.extract_features(image)
+        image_data = decode_base64_body(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        # Extract features using CLIP model (cached by image content)
+        features = await extract_upload_features(image_data)
         
         # Find matching bottles in the database with confidence threshold
-        matches = bottle_db.find_matches(features, top_k=3, confidence_threshold=confidence_threshold)
+        matches = await anyio.to_thread.run_sync(
+            bottle_db.find_matches, features, 3, confidence_threshold
+        )
         
         # Calculate processing time
         processing_time = (datetime.now() - start_time).total_seconds() * 1000
@@ -0,0 +1,121 @@
+import asyncio
+
+import anyio
+
+
+class BatchedFeatureExtractor:
+    """
+    Collects concurrent feature extraction requests and runs them
+    through the CLIP model as a single batch.
+    """
+
+    def __init__(self, processor, max_batch=16, max_wait_ms=5.0):
+        """
+        Initialize the batched extractor.
+
+        Args:
+            processor: WhiskyBottleProcessor used for inference
+            max_batch: Maximum number of images per forward pass
+            max_wait_ms: How long to wait for more images before running a batch
+        """
+        self.processor = processor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.queue = None
+        self._worker = None
+
+    def start(self):
+        """Start the background batching worker on the running event loop."""
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background batching worker."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # Fail requests that were still waiting so their callers return
+        while self.queue is not None and not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            self._fail(future, RuntimeError("shutting down"))
+
+    @staticmethod
+    def _fail(future, error):
+        """Resolve a pending future with an error."""
+        if not future.done():
+            future.set_exception(error)
+
+    async def submit(self, image):
+        """
+        Queue an image for feature extraction and wait for its result.
+
+        Args:
+            image: PIL Image or file path
+
+        Returns:
+            Feature vector (numpy array)
+        """
+        # Preprocess up front so a bad image only fails its own request
+        image = await anyio.to_thread.run_sync(self.processor.preprocess_image, image)
+
+        if self._worker is None:
+            raise RuntimeError("shutting down")
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _collect_batch(self):
+        """Wait for one request, then gather more until the batch is full or the timeout expires."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        try:
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Requests already taken off the queue are not drained by stop()
+            for _, future in batch:
+                self._fail(future, RuntimeError("shutting down"))
+            raise
+
+        # Drop requests whose callers have gone away
+        return [(image, future) for image, future in batch if not future.done()]
+
+    async def _run(self):
+        """Background worker that drains the queue in batches."""
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            images = [image for image, _ in batch]
+            try:
+                features = await anyio.to_thread.run_sync(
+                    self.processor.extract_batch_features, images
+                )
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    self._fail(future, RuntimeError("shutting down"))
+                raise
+            except Exception as e:
+                for _, future in batch:
+                    self._fail(future, e)
+                continue
+
+            for (_, future), row in zip(batch, features):
+                if not future.done():
+                    future.set_result(row)
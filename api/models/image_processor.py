@@ -1,9 +1,55 @@
+import io
 import os
+from contextlib import contextmanager
 import torch
 import numpy as np
+import onnxruntime as ort
 from PIL import Image
-import cv2
-from transformers import CLIPProcessor, CLIPModel
+from torchvision.transforms import v2
+from torchvision.io import ImageReadMode, decode_jpeg
+from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
+
+class _VisionEncoder(torch.nn.Module):
+    """
+    CLIP vision tower followed by its projection, returning image
+    embeddings only. Small enough to quantize and trace on its own.
+    """
+    
+    def __init__(self, vision_model, visual_projection):
+        super().__init__()
+        self.vision_model = vision_model
+        self.visual_projection = visual_projection
+    
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values, return_dict=False)[1]
+        return self.visual_projection(pooled_output)
+
+class _OnnxEncoder:
+    """
+    Runs an exported CLIP vision encoder with ONNX Runtime, taking and
+    returning torch tensors like the PyTorch encoders.
+    """
+    
+    def __init__(self, session):
+        self.session = session
+    
+    def __call__(self, pixel_values):
+        outputs = self.session.run(None, {"pixel_values": pixel_values.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+@contextmanager
+def _atomic_path(path):
+    """
+    Yield a temporary path next to `path` and move it into place once
+    written, so concurrent workers never load a partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 class WhiskyBottleProcessor:
     """
@@ -11,25 +57,192 @@ class WhiskyBottleProcessor:
     to extract feature embeddings.
     """
     
-    def __init__(self, model_name="openai/clip-vit-base-patch32"):
+    def __init__(self, model_name="openai/clip-vit-base-patch32", quantize=True, compile=True,
+                 backend="auto", onnx_dir="data/onnx", max_batch_size=16):
         """
         Initialize the CLIP model and processor.
         
         Args:
             model_name: Hugging Face model name for CLIP
+            quantize: Run the vision encoder in FP16 on GPU or INT8 on CPU
+            compile: Compile the vision encoder with torch.compile when it
+                is not already a TorchScript graph
+            backend: "torch", "onnx", or "auto" to use ONNX Runtime on CPU
+            onnx_dir: Directory the exported ONNX models are cached in
+            max_batch_size: Largest batch a compiled encoder is warmed up
+                for; larger batches are run in chunks of this size
         """
+        self.model_name = model_name
+        self.onnx_dir = onnx_dir
+        self.max_batch_size = max_batch_size
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"Using device: {self.device}")
         
-        # Load CLIP model and processor
-        self.model = CLIPModel.from_pretrained(model_name).to(self.device)
-        self.processor = CLIPProcessor.from_pretrained(model_name)
+        # Load only the CLIP vision tower; the text encoder is never used.
+        # The model is kept only as long as the encoder built from it needs it.
+        model = CLIPVisionModelWithProjection.from_pretrained(model_name).to(self.device)
+        model.eval()
+        self.projection_dim = model.config.projection_dim
+        self.image_processor = CLIPImageProcessor.from_pretrained(model_name)
+        
+        # Resize, crop and normalize the way CLIP expects, without the
+        # generic Hugging Face processor in the request path. Works on
+        # uint8 CHW tensors so images are preprocessed on the device.
+        self.image_size = self.image_processor.crop_size["height"]
+        self.transform = v2.Compose([
+            v2.Resize(
+                self.image_processor.size["shortest_edge"],
+                interpolation=v2.InterpolationMode.BICUBIC,
+                antialias=True
+            ),
+            v2.CenterCrop(self.image_size),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize(
+                mean=self.image_processor.image_mean,
+                std=self.image_processor.image_std
+            ),
+        ])
+        
+        # Host-to-device copies run on a side stream to overlap with compute
+        self.copy_stream = torch.cuda.Stream() if self.device == "cuda" else None
         
-        # Set model to evaluation mode
-        self.model.eval()
+        # Build the (optionally quantized) image encoder used for inference
+        self.dtype = torch.float32
+        self.pad_batches = False
+        self.encoder = self._build_encoder(model, quantize, compile, backend)
         
         print(f"Loaded CLIP model: {model_name}")
     
+    def _build_encoder(self, model, quantize, compile, backend):
+        """
+        Build the image encoder from the CLIP vision tower.
+        
+        With the ONNX backend the encoder is exported and run by ONNX Runtime,
+        with INT8 weights when quantized. With the PyTorch backend, on GPU the
+        encoder is cast to FP16; on CPU the linear layers are quantized to
+        INT8 and the result is traced and frozen with TorchScript. Encoders
+        left in eager mode are compiled with torch.compile.
+        
+        Args:
+            model: CLIP vision model to build the encoder from
+            quantize: Whether to quantize the encoder
+            compile: Whether to compile an eager encoder
+            backend: "torch", "onnx", or "auto"
+            
+        Returns:
+            Callable mapping pixel values to image embeddings
+        """
+        encoder = _VisionEncoder(model.vision_model, model.visual_projection).eval()
+        
+        example_pixel_values = torch.zeros(1, 3, self.image_size, self.image_size)
+        
+        if backend == "auto":
+            backend = "onnx" if self.device == "cpu" else "torch"
+        
+        if backend == "onnx":
+            encoder = self._build_onnx_encoder(encoder, example_pixel_values, quantize)
+        elif backend != "torch":
+            raise ValueError(f"Unknown backend: {backend}")
+        elif quantize and self.device == "cuda":
+            model.half()
+            self.dtype = torch.float16
+        elif quantize:
+            encoder = torch.ao.quantization.quantize_dynamic(
+                encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+            with torch.no_grad():
+                encoder = torch.jit.trace(encoder, example_pixel_values)
+                encoder = torch.jit.freeze(encoder)
+            torch._C._jit_set_texpr_fuser_enabled(True)
+        
+        warmup_sizes = [1]
+        if compile and isinstance(encoder, _VisionEncoder):
+            # Static shapes let Inductor fuse kernels; batches are padded to
+            # powers of two so only a few graphs are compiled. The default
+            # mode keeps CUDA graphs off, as their state is thread-local and
+            # requests run on worker threads.
+            encoder = torch.compile(encoder, dynamic=False)
+            self.pad_batches = True
+            warmup_sizes = [1 << i for i in range((self.max_batch_size - 1).bit_length() + 1)]
+        
+        # Warm up every batch size that can occur so compilation and kernel
+        # selection happen at startup rather than on a live request
+        with torch.no_grad():
+            for size in warmup_sizes:
+                pixel_values = example_pixel_values.expand(size, -1, -1, -1)
+                encoder(pixel_values.to(self.device, dtype=self.dtype))
+        
+        return encoder
+    
+    def _build_onnx_encoder(self, encoder, example_pixel_values, quantize):
+        """
+        Export the encoder to ONNX (once, cached on disk) and load it into
+        an ONNX Runtime CPU session with all graph optimizations enabled.
+        
+        Args:
+            encoder: PyTorch vision encoder to export
+            example_pixel_values: Example input used for the export
+            quantize: Load a copy with dynamically quantized INT8 weights
+            
+        Returns:
+            _OnnxEncoder wrapping the inference session
+        """
+        os.makedirs(self.onnx_dir, exist_ok=True)
+        base_name = self.model_name.replace("/", "_")
+        model_path = os.path.join(self.onnx_dir, f"{base_name}_vision.onnx")
+        quantized_path = os.path.join(self.onnx_dir, f"{base_name}_vision_int8.onnx")
+        
+        if not os.path.exists(model_path):
+            print(f"Exporting CLIP vision encoder to {model_path}")
+            with _atomic_path(model_path) as tmp_path:
+                torch.onnx.export(
+                    encoder.cpu(),
+                    example_pixel_values,
+                    tmp_path,
+                    input_names=["pixel_values"],
+                    output_names=["image_embeds"],
+                    dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                    opset_version=17
+                )
+        
+        if quantize and not os.path.exists(quantized_path):
+            # Imported here since it pulls in the onnx package
+            from onnxruntime import quantization as ort_quantization
+            
+            with _atomic_path(quantized_path) as tmp_path:
+                ort_quantization.quantize_dynamic(
+                    model_path, tmp_path, weight_type=ort_quantization.QuantType.QInt8
+                )
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        session = ort.InferenceSession(
+            quantized_path if quantize else model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        return _OnnxEncoder(session)
+    
+    def decode_image(self, contents):
+        """
+        Decode raw image bytes from an upload.
+        
+        On GPU, JPEGs are decoded directly on the device with nvJPEG;
+        everything else is decoded by Pillow. Images are decoded at full
+        resolution, like the dataset images the index is built from.
+        
+        Args:
+            contents: Encoded image bytes
+            
+        Returns:
+            uint8 CHW tensor on the device, or a PIL Image
+        """
+        if self.device == "cuda" and contents[:3] == b"\xff\xd8\xff":
+            data = torch.frombuffer(bytearray(contents), dtype=torch.uint8)
+            return decode_jpeg(data, mode=ImageReadMode.RGB, device=self.device)
+        return Image.open(io.BytesIO(contents))
+    
     def preprocess_image(self, image):
         """
         Preprocess image for better recognition:
@@ -37,18 +250,23 @@ class WhiskyBottleProcessor:
         - Perform image enhancements (lighting correction, etc.)
         
         Args:
-            image: PIL Image or file path
+            image: PIL Image, file path, numpy array, or decoded uint8 tensor
             
         Returns:
-            Preprocessed PIL Image
+            Preprocessed PIL Image, or the tensor unchanged
         """
+        # Decoded tensors are already RGB and need no conversion
+        if isinstance(image, torch.Tensor):
+            return image
+        
         # Load image if it's a file path
         if isinstance(image, str):
             image = Image.open(image).convert('RGB')
         elif isinstance(image, np.ndarray):
-            image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            # Arrays are BGR (OpenCV convention); reverse the channel axis
+            image = Image.fromarray(image[..., 2::-1] if image.ndim == 3 else image)
         elif not isinstance(image, Image.Image):
-            raise ValueError("Image must be a PIL Image, file path, or numpy array")
+            raise ValueError("Image must be a PIL Image, file path, numpy array, or tensor")
         
         # Convert to RGB if needed
         if image.mode != 'RGB':
@@ -57,6 +275,34 @@ class WhiskyBottleProcessor:
         # No heavy preprocessing to let CLIP work with its expected input
         return image
     
+    def _to_tensor(self, image):
+        """Convert a preprocessed image to a uint8 CHW tensor."""
+        if isinstance(image, torch.Tensor):
+            return image
+        return v2.functional.pil_to_tensor(image)
+    
+    def _to_device(self, images):
+        """
+        Yield preprocessed images as tensors on the device.
+        
+        On GPU each image is pinned and copied on the copy stream, so the
+        next image is pinned and transferred while the current one is
+        being transformed on the compute stream.
+        """
+        for image in images:
+            tensor = self._to_tensor(image)
+            if self.copy_stream is None or tensor.is_cuda:
+                yield tensor.to(self.device)
+                continue
+            
+            compute_stream = torch.cuda.current_stream()
+            with torch.cuda.stream(self.copy_stream):
+                tensor = tensor.pin_memory().to(self.device, non_blocking=True)
+            compute_stream.wait_stream(self.copy_stream)
+            # The tensor was allocated on the copy stream but is used on compute
+            tensor.record_stream(compute_stream)
+            yield tensor
+    
     def extract_features(self, image):
         """
         Extract feature embeddings from an image using CLIP.
@@ -67,45 +313,95 @@ class WhiskyBottleProcessor:
         Returns:
             Feature vector (numpy array)
         """
-        # Preprocess the image
-        processed_image = self.preprocess_image(image)
+        return self.extract_batch_features([image])[0]
+    
+    def extract_batch_features(self, images):
+        """
+        Extract feature embeddings for several images in a single
+        forward pass through CLIP.
+        
+        Args:
+            images: List of PIL Images or file paths
+            
+        Returns:
+            Feature matrix (numpy array, one row per image)
+        """
+        # Preprocess the images
+        processed_images = [self.preprocess_image(image) for image in images]
         
-        # Process image with CLIP
+        # Process all images with CLIP at once
         with torch.no_grad():
-            inputs = self.processor(
-                images=processed_image,
-                return_tensors="pt"
-            ).to(self.device)
+            pixel_values = torch.stack([
+                self.transform(tensor)
+                for tensor in self._to_device(processed_images)
+            ])
+        
+        return self.encode(pixel_values)
+    
+    def encode(self, pixel_values):
+        """
+        Run a batch of preprocessed images through the CLIP encoder.
+        
+        Args:
+            pixel_values: Float tensor of shape (batch, 3, height, width)
+            
+        Returns:
+            Feature matrix (numpy array, one row per image)
+        """
+        if self.pad_batches and len(pixel_values) > self.max_batch_size:
+            # Stay within the batch sizes the compiled encoder was warmed up for
+            return np.concatenate([
+                self.encode(chunk) for chunk in pixel_values.split(self.max_batch_size)
+            ])
+        
+        with torch.no_grad():
+            pixel_values = pixel_values.to(self.device, dtype=self.dtype, non_blocking=True)
+            
+            # Pad to the next power of two so compiled graphs are reused
+            batch_size = len(pixel_values)
+            padded_size = 1 << (batch_size - 1).bit_length()
+            if self.pad_batches and padded_size != batch_size:
+                padding = pixel_values.new_zeros((padded_size - batch_size, *pixel_values.shape[1:]))
+                pixel_values = torch.cat([pixel_values, padding])
             
             # Extract image features
-            features = self.model.get_image_features(**inputs)
+            features = self.encoder(pixel_values)[:batch_size].float()
             
             # Normalize features to unit length
             features = features / features.norm(dim=-1, keepdim=True)
             
             # Convert to numpy array
-            features_np = features.cpu().numpy().flatten()
+            features_np = features.cpu().numpy()
         
         return features_np
     
-    def compute_batch_features(self, image_paths):
+    def compute_batch_features(self, image_paths, batch_size=64):
         """
         Compute features for a batch of images.
         
         Args:
             image_paths: List of file paths to images
+            batch_size: Number of images per forward pass
             
         Returns:
-            Dictionary mapping file paths to feature vectors
+            Tuple of (processed paths, float32 feature matrix with one row per path)
         """
-        features_dict = {}
+        paths = []
+        features = np.empty((len(image_paths), self.projection_dim), dtype=np.float32)
         
-        for path in image_paths:
-            try:
-                features = self.extract_features(path)
-                features_dict[path] = features
-                print(f"Processed {path}")
-            except Exception as e:
-                print(f"Error processing {path}: {e}")
+        for start in range(0, len(image_paths), batch_size):
+            batch_paths = []
+            images = []
+            for path in image_paths[start:start + batch_size]:
+                try:
+                    images.append(self.preprocess_image(path))
+                    batch_paths.append(path)
+                except Exception as e:
+                    print(f"Error processing {path}: {e}")
+            
+            if images:
+                features[len(paths):len(paths) + len(images)] = self.extract_batch_features(images)
+                paths.extend(batch_paths)
+                print(f"Processed {len(paths)}/{len(image_paths)} images")
         
-        return features_dict 
\ No newline at end of file
+        return paths, features[:len(paths)]
@@ -1,12 +1,26 @@
 import os
-import glob
 import argparse
 import json
 from tqdm import tqdm
 import shutil
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision.transforms import v2
 from PIL import Image
 from models.image_processor import WhiskyBottleProcessor
-from utils.database import BottleDatabase
+from utils.database import INDEX_TYPES, BottleDatabase
+from utils.prefetch import PrefetchReader
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+def list_image_files(input_dir):
+    """List image files in a directory with a single directory scan."""
+    with os.scandir(input_dir) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.is_file() and entry.name.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+        )
 
 def extract_bottle_name(filename):
     """Extract bottle name from filename."""
@@ -20,7 +34,40 @@ def extract_bottle_name(filename):
     
     return name
 
-def process_dataset(input_dir, output_dir, metadata_file):
+class BottleDataset(Dataset):
+    """Loads bottle images and preprocesses them for CLIP."""
+    
+    def __init__(self, image_files, transform):
+        """
+        Args:
+            image_files: List of image file paths
+            transform: Preprocessing applied to each uint8 image tensor
+        """
+        self.image_files = image_files
+        self.transform = transform
+    
+    def __len__(self):
+        return len(self.image_files)
+    
+    def __getitem__(self, idx):
+        image_file = self.image_files[idx]
+        try:
+            image = Image.open(image_file).convert('RGB')
+            return image_file, self.transform(v2.functional.pil_to_tensor(image))
+        except Exception as e:
+            print(f"Error processing {image_file}: {e}")
+            return image_file, None
+
+def collate_images(samples):
+    """Stack preprocessed images into a batch, skipping ones that failed to load."""
+    samples = [(path, tensor) for path, tensor in samples if tensor is not None]
+    if not samples:
+        return [], None
+    paths, tensors = zip(*samples)
+    return list(paths), torch.stack(tensors)
+
+def process_dataset(input_dir, output_dir, metadata_file, batch_size=64, num_workers=None,
+                    image_files=None, index_type="auto"):
     """
     Process all bottle images in the dataset and generate embeddings.
     
@@ -28,67 +75,87 @@ def process_dataset(input_dir, output_dir, metadata_file):
         input_dir: Directory containing bottle images
         output_dir: Directory to save embeddings
         metadata_file: Path to save metadata JSON
+        batch_size: Number of images per forward pass
+        num_workers: DataLoader worker processes (defaults to CPU count)
+        image_files: Image paths to process (defaults to scanning input_dir)
+        index_type: FAISS index type to build (see BottleDatabase)
     """
     # Ensure output directories exist
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
     
     # Initialize image processor and database
-    processor = WhiskyBottleProcessor()
-    database = BottleDatabase(embeddings_dir=output_dir, metadata_file=metadata_file)
+    processor = WhiskyBottleProcessor(max_batch_size=batch_size)
+    database = BottleDatabase(embeddings_dir=output_dir, metadata_file=metadata_file,
+                              index_type=index_type)
     
     # Get all image files
-    image_files = []
-    for ext in ['jpg', 'jpeg', 'png']:
-        image_files.extend(glob.glob(os.path.join(input_dir, f"*.{ext}")))
-        image_files.extend(glob.glob(os.path.join(input_dir, f"*.{ext.upper()}")))
+    if image_files is None:
+        image_files = list_image_files(input_dir)
     
     print(f"Found {len(image_files)} images in {input_dir}")
     
-    # Process each image
-    for image_file in tqdm(image_files, desc="Processing images"):
-        try:
+    # Decode and preprocess in worker processes, run inference in batches
+    loader = DataLoader(
+        BottleDataset(image_files, processor.transform),
+        batch_size=batch_size,
+        num_workers=os.cpu_count() if num_workers is None else num_workers,
+        pin_memory=processor.device == "cuda",
+        collate_fn=collate_images
+    )
+    
+    def to_device(item):
+        paths, batch = item
+        if batch is not None:
+            batch = batch.to(processor.device, non_blocking=True)
+        return paths, batch
+    
+    # Fetch and copy upcoming batches in a background thread while the
+    # current one runs through the model
+    reader = PrefetchReader(loader, transform=to_device, num_prefetch=2)
+    
+    # Collect every bottle first and add them to the database in one go
+    bottle_ids = []
+    bottle_names = []
+    image_urls = []
+    all_features = np.empty((len(image_files), processor.projection_dim), dtype=np.float32)
+    
+    for paths, batch in tqdm(reader, desc="Processing images"):
+        if batch is None:
+            continue
+        
+        # Extract features for the whole batch
+        features = processor.encode(batch)
+        all_features[len(bottle_ids):len(bottle_ids) + len(paths)] = features
+        
+        for image_file in paths:
             # Generate a unique ID for the bottle
-            bottle_id = os.path.splitext(os.path.basename(image_file))[0]
+            bottle_ids.append(os.path.splitext(os.path.basename(image_file))[0])
             
             # Extract bottle name
-            bottle_name = extract_bottle_name(image_file)
-            
-            # Extract features
-            features = processor.extract_features(image_file)
-            
-            # Add to database
-            database.add_bottle(
-                bottle_id=bottle_id,
-                name=bottle_name,
-                features=features,
-                image_url=f"images/{os.path.basename(image_file)}",
-                save=True
-            )
-            
-            # Print progress
-            print(f"Processed {bottle_name}")
-            
-        except Exception as e:
-            print(f"Error processing {image_file}: {e}")
+            bottle_names.append(extract_bottle_name(image_file))
+            image_urls.append(f"images/{os.path.basename(image_file)}")
     
-    # Save the FAISS index
+    # Build the index type suited to the dataset size before writing
+    # anything, so a failed build leaves the previous output intact
+    database.add_bottles(bottle_ids, bottle_names, all_features[:len(bottle_ids)],
+                         image_urls=image_urls, save=False)
+    database.build_index()
+    database.save_embeddings()
     database.save_index()
     
     print(f"Processing complete. Processed {len(database.metadata)} bottles.")
     print(f"Metadata saved to {metadata_file}")
-    print(f"Embeddings saved to {output_dir}")
-    print(f"FAISS index saved to data/faiss.index")
+    print(f"Embeddings saved to {database.embeddings_file}")
+    print(f"FAISS index saved to {database.index_file}")
 
-def copy_images(input_dir, output_dir):
+def copy_images(input_dir, output_dir, image_files=None):
     """Copy images to the web server's static directory."""
     os.makedirs(output_dir, exist_ok=True)
     
     # Get all image files
-    image_files = []
-    for ext in ['jpg', 'jpeg', 'png']:
-        image_files.extend(glob.glob(os.path.join(input_dir, f"*.{ext}")))
-        image_files.extend(glob.glob(os.path.join(input_dir, f"*.{ext.upper()}")))
+    if image_files is None:
+        image_files = list_image_files(input_dir)
     
     # Copy each image
     for image_file in tqdm(image_files, desc="Copying images"):
@@ -106,12 +173,21 @@ if __name__ == "__main__":
     parser.add_argument("--metadata", "-m", default="data/metadata.json", help="Output file for metadata")
     parser.add_argument("--copy-images", "-c", action="store_true", help="Copy images to static directory")
     parser.add_argument("--image-output", default="static/images", help="Output directory for images")
+    parser.add_argument("--batch-size", "-b", type=int, default=64, help="Images per inference batch")
+    parser.add_argument("--num-workers", type=int, default=None, help="Image loading worker processes")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="auto",
+                        help="FAISS index type (auto picks by dataset size)")
     
     args = parser.parse_args()
     
+    # Scan the input directory once for both steps
+    image_files = list_image_files(args.input)
+    
     # Process dataset
-    process_dataset(args.input, args.output, args.metadata)
+    process_dataset(args.input, args.output, args.metadata,
+                    batch_size=args.batch_size, num_workers=args.num_workers,
+                    image_files=image_files, index_type=args.index_type)
     
     # Copy images if requested
     if args.copy_images:
-        copy_images(args.input, args.image_output) 
\ No newline at end of file
+        copy_images(args.input, args.image_output, image_files=image_files) 
\ No newline at end of file
@@ -7,9 +7,21 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="0.0.0.0", help="Server host")
     parser.add_argument("--port", "-p", type=int, default=8000, help="Server port")
     parser.add_argument("--reload", "-r", action="store_true", help="Enable auto-reload")
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                        help="Number of worker processes (default: one per CPU core without a GPU, otherwise 1)")
     
     args = parser.parse_args()
     
+    # CPU-only hosts scale by running one worker per core; on GPU the
+    # batching queue in a single worker keeps the device busy instead
+    workers = args.workers
+    if workers is None:
+        import torch
+        workers = 1 if torch.cuda.is_available() else os.cpu_count()
+    
+    # Split the cores between workers instead of each claiming all of them
+    os.environ.setdefault('OMP_NUM_THREADS', str(max(1, os.cpu_count() // workers)))
+    
     # Set environment variables
     os.environ['PYTHONPATH'] = os.path.abspath('.')
     
@@ -18,5 +30,6 @@ if __name__ == "__main__":
         "app.main:app",
         host=args.host,
         port=args.port,
-        reload=args.reload
+        reload=args.reload,
+        workers=workers
     ) 
\ No newline at end of file
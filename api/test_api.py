@@ -1,4 +1,5 @@
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import os
 import base64
@@ -6,6 +7,12 @@ import time
 import json
 from PIL import Image
 
+# Reuse one connection pool for all requests
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
 def test_identify(api_url, image_path):
     """
     Test the image identification endpoint with a file upload.
@@ -16,15 +23,11 @@ def test_identify(api_url, image_path):
     """
     print(f"\nTesting /api/identify with {image_path}")
     
-    # Prepare file for upload
-    files = {
-        'file': open(image_path, 'rb')
-    }
-    
-    # Send request
-    start_time = time.time()
-    response = requests.post(f"{api_url}/api/identify", files=files)
-    elapsed = time.time() - start_time
+    # Send request with the file open only for the upload
+    with open(image_path, 'rb') as f:
+        start_time = time.time()
+        response = session.post(f"{api_url}/api/identify", files={'file': f})
+        elapsed = time.time() - start_time
     
     # Process response
     if response.status_code == 200:
@@ -54,7 +57,7 @@ def test_identify_base64(api_url, image_path):
     
     # Send request
     start_time = time.time()
-    response = requests.post(
+    response = session.post(
         f"{api_url}/api/identify_base64", 
         json={'base64_image': b64_string}
     )
@@ -75,7 +78,7 @@ def test_identify_base64(api_url, image_path):
 def test_list_bottles(api_url):
     """Test the endpoint to list all bottles."""
     print("\nTesting /api/bottles")
-    response = requests.get(f"{api_url}/api/bottles")
+    response = session.get(f"{api_url}/api/bottles")
     
     if response.status_code == 200:
         bottles = response.json()
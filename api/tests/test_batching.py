@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.batching import BatchedFeatureExtractor
+
+
+class StubProcessor:
+    """Stands in for WhiskyBottleProcessor, returning each image as its feature."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def preprocess_image(self, image):
+        return image
+
+    def extract_batch_features(self, images):
+        self.batches.append(list(images))
+        time.sleep(self.delay)
+        return np.array(images, dtype=np.float32)[:, None]
+
+
+def run_requests(extractor, images, stop_after=None):
+    async def main():
+        extractor.start()
+        tasks = [asyncio.create_task(extractor.submit(image)) for image in images]
+        if stop_after is not None:
+            await asyncio.sleep(stop_after)
+            await extractor.stop()
+        results = await asyncio.wait_for(
+            asyncio.gather(*tasks, return_exceptions=True), timeout=5
+        )
+        await extractor.stop()
+        return results
+
+    return asyncio.run(main())
+
+
+def test_batches_concurrent_requests():
+    processor = StubProcessor()
+    results = run_requests(BatchedFeatureExtractor(processor, max_wait_ms=50), [1, 2, 3])
+    assert [float(row[0]) for row in results] == [1, 2, 3]
+    assert processor.batches == [[1, 2, 3]]
+
+
+@pytest.mark.parametrize("processor, max_wait_ms", [
+    # Stopped while the batch is still being collected
+    (StubProcessor(), 1000),
+    # Stopped while the batch is running through the model
+    (StubProcessor(delay=0.5), 1),
+])
+def test_stop_fails_pending_requests(processor, max_wait_ms):
+    extractor = BatchedFeatureExtractor(processor, max_wait_ms=max_wait_ms)
+    results = run_requests(extractor, [1, 2, 3], stop_after=0.1)
+    assert len(results) == 3
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_submit_after_stop():
+    extractor = BatchedFeatureExtractor(StubProcessor())
+
+    async def main():
+        extractor.start()
+        await extractor.stop()
+        await extractor.submit(1)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
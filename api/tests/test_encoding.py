@@ -0,0 +1,68 @@
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.encoding import decode_base64_body
+
+# Enough bytes that base64.encodebytes wraps the output over several lines
+IMAGE = bytes(range(256)) * 4
+
+
+def test_json_body():
+    body = json.dumps({"base64_image": base64.b64encode(IMAGE).decode()}).encode()
+    assert decode_base64_body(body) == IMAGE
+
+
+def test_json_body_wrapped():
+    encoded = base64.encodebytes(IMAGE).decode()
+    assert "\n" in encoded
+    body = json.dumps({"base64_image": encoded}).encode()
+    assert b"\\n" in body
+    assert decode_base64_body(body) == IMAGE
+
+
+def test_json_body_escaped():
+    encoded = base64.b64encode(IMAGE).decode()
+    escaped = "".join(f"\\u{ord(c):04x}" if c == "+" else c for c in encoded)
+    escaped = escaped.replace("/", "\\/")
+    body = ('{"base64_image": "' + escaped + '"}').encode()
+    assert decode_base64_body(body) == IMAGE
+
+
+def test_json_body_data_uri():
+    uri = "data:image/jpeg;base64," + base64.b64encode(IMAGE).decode()
+    body = json.dumps({"base64_image": uri}).encode()
+    assert decode_base64_body(body) == IMAGE
+
+
+def test_text_body_data_uri():
+    body = b"data:image/jpeg;base64," + base64.encodebytes(IMAGE)
+    assert decode_base64_body(body) == IMAGE
+
+
+def test_text_body():
+    assert decode_base64_body(base64.b64encode(IMAGE)) == IMAGE
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b"  \n",
+    b'{"base64_image": ""}',
+    b"data:image/jpeg;base64,",
+    b"!!!!AAAA",
+    b'{"base64_image": "!!!!AAAA"}',
+    b'{"base64_image": ',
+    b'{"image": "AAAA"}',
+    b'{"base64_image": 1}',
+    b'{"base64_image": "\\u00e9AAA"}',
+    b'{"base64_image": "AAA"}',
+    b"data:image/jpeg;base64",
+])
+def test_bad_body(body):
+    with pytest.raises(ValueError):
+        decode_base64_body(body)
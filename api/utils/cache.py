@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+
+import xxhash
+
+
+class FeatureCache:
+    """
+    Thread-safe LRU cache of feature vectors keyed on a hash of the
+    raw image bytes, so repeated uploads skip decoding and inference.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of feature vectors to keep
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(contents: bytes) -> int:
+        """Hash raw image bytes into a cache key."""
+        return xxhash.xxh3_64_intdigest(contents)
+
+    def get(self, key: int):
+        """Return the cached features for a key, or None on a miss."""
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+            return features
+
+    def put(self, key: int, features):
+        """Store features for a key, evicting the least recently used entry."""
+        with self._lock:
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
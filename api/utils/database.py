@@ -1,11 +1,23 @@
 import os
-import json
-import glob
 import numpy as np
 import faiss
+import orjson
 from typing import List, Dict, Optional
 import pickle
 
+# Corpus sizes at which the "auto" index type switches to an approximate index
+HNSW_MIN_BOTTLES = 10000
+IVFPQ_MIN_BOTTLES = 1000000
+
+# IVF-PQ trains a 256-entry codebook per subquantizer, so it needs at least this many vectors
+IVFPQ_MIN_TRAINING = 256
+
+# Index types accepted by BottleDatabase
+INDEX_TYPES = ["auto", "flat", "hnsw", "ivfpq", "int8", "binary"]
+
+# Candidates fetched per result from an approximate index before exact re-ranking
+RERANK_FACTOR = 4
+
 class BottleMatch:
     """Data class for bottle matches."""
     def __init__(self, id: str, name: str, confidence: float, image_url: Optional[str] = None):
@@ -29,64 +41,174 @@ class BottleDatabase:
     """
     
     def __init__(self, embeddings_dir: str = "data/embeddings", 
-                 metadata_file: str = "data/metadata.json"):
+                 metadata_file: str = "data/metadata.json",
+                 index_file: str = "data/faiss.index",
+                 index_type: str = "auto"):
         """
         Initialize the bottle database.
         
         Args:
             embeddings_dir: Directory containing embeddings
             metadata_file: JSON file containing bottle metadata
+            index_file: File the FAISS index is persisted to
+            index_type: "flat", "hnsw", "ivfpq", "int8", "binary",
+                or "auto" to pick by corpus size
         """
         self.embeddings_dir = embeddings_dir
         self.metadata_file = metadata_file
+        self.index_file = index_file
+        self.index_type = index_type
+        self.embeddings_file = os.path.join(embeddings_dir, "embeddings.npy")
+        self.ids_file = os.path.join(embeddings_dir, "ids.json")
         
         # Ensure data directories exist
         os.makedirs(embeddings_dir, exist_ok=True)
         os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
         
-        # Initialize FAISS index (vector dimension from CLIP model is 512)
+        # Embeddings are kept as one contiguous (N, 512) float32 matrix;
+        # row i belongs to index_to_id[i] (vector dimension from CLIP is 512)
         self.dimension = 512
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
+        self.embeddings = np.empty((0, self.dimension), dtype=np.float32)
+        self._buffer = self.embeddings  # Over-allocated storage behind self.embeddings
+        
+        # Approximate FAISS index, or None to search the matrix exactly
+        self.index = None
+        # File the index was memory-mapped read-only from, if it was
+        self._mapped_index_file = None
         
         # Metadata for bottles
         self.metadata = {}
-        self.id_to_index = {}  # Maps bottle ID to index in FAISS
+        self.id_to_index = {}  # Maps bottle ID to row in the embedding matrix
+        self.index_to_id = []  # Maps row in the embedding matrix back to bottle ID
         
         print(f"Initialized BottleDatabase with FAISS index")
     
-    def load_embeddings(self):
+    def _create_index(self, num_bottles: int):
+        """
+        Create an empty FAISS index suited to the given corpus size.
+        
+        Features are L2-normalized, so inner product equals cosine similarity
+        for every index type. The "int8" and "binary" types scan compressed
+        codes (1 byte and 1 bit per dimension) to cut memory traffic.
+        
+        Args:
+            num_bottles: Number of vectors the index will hold
+            
+        Returns:
+            FAISS index, or None when the matrix should be searched exactly
+        """
+        index_type = self.index_type
+        if index_type == "auto":
+            if num_bottles >= IVFPQ_MIN_BOTTLES:
+                index_type = "ivfpq"
+            elif num_bottles >= HNSW_MIN_BOTTLES:
+                index_type = "hnsw"
+            else:
+                index_type = "flat"
+        elif index_type == "ivfpq" and num_bottles < IVFPQ_MIN_TRAINING:
+            print(f"Warning: IVF-PQ needs at least {IVFPQ_MIN_TRAINING} bottles to train, "
+                  f"got {num_bottles}; using exact search instead")
+            index_type = "flat"
+        
+        if index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dimension, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
+        elif index_type == "ivfpq":
+            nlist = max(1, int(np.sqrt(num_bottles)))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, 64, 8,
+                                     faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = max(1, nlist // 16)
+        elif index_type == "int8":
+            index = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+        elif index_type == "binary":
+            index = faiss.IndexBinaryFlat(self.dimension)
+        elif index_type == "flat":
+            index = None
+        else:
+            raise ValueError(f"Unknown index type: {index_type}")
+        
+        return index
+    
+    def _build_index(self, features: np.ndarray):
+        """
+        Build a FAISS index from a matrix of normalized features.
+        
+        Args:
+            features: Feature matrix, one row per bottle
+        """
+        index = self._create_index(len(features))
+        if index is None:
+            return None
+        features = self._index_input(index, features)
+        if not index.is_trained:
+            index.train(features)
+        index.add(features)
+        return index
+    
+    @staticmethod
+    def _index_input(index, features: np.ndarray) -> np.ndarray:
+        """Convert float features to the input format of the given index."""
+        if isinstance(index, faiss.IndexBinary):
+            # Keep the sign of each dimension, packed 8 per byte
+            return np.packbits(features > 0, axis=1)
+        return features
+    
+    def build_index(self):
+        """
+        Rebuild the FAISS index with the index type appropriate for the
+        current number of bottles. Call this after adding bottles to a
+        freshly created database.
+        """
+        if len(self.embeddings) == 0:
+            return
+        self.index = self._build_index(self.embeddings)
+        self._mapped_index_file = None
+        if self.index is not None:
+            print(f"Built {type(self.index).__name__} with {self.index.ntotal} vectors")
+    
+    def load_embeddings(self, mmap: bool = False):
         """
         Load precomputed embeddings and metadata.
+        
+        Args:
+            mmap: Memory-map the embedding matrix and FAISS index read-only,
+                so worker processes share one copy through the page cache.
+                FAISS only memory-maps IVF inverted lists (the "ivfpq" type);
+                other saved indexes, such as HNSW, are still read into each
+                process. Exact search and IVF-PQ are fully shared. Adding
+                bottles afterwards copies the matrix and a mapped IVF-PQ
+                index into private memory first.
         """
         # Load metadata if it exists
         if os.path.exists(self.metadata_file):
-            with open(self.metadata_file, 'r') as f:
-                self.metadata = json.load(f)
+            with open(self.metadata_file, 'rb') as f:
+                self.metadata = orjson.loads(f.read())
             print(f"Loaded metadata for {len(self.metadata)} bottles")
         
-        # Load embeddings if they exist
-        embedding_files = glob.glob(os.path.join(self.embeddings_dir, "*.npy"))
-        if embedding_files:
-            # Reset index
-            self.index = faiss.IndexFlatIP(self.dimension)
-            
-            # Load and add each embedding
-            for i, embedding_file in enumerate(embedding_files):
-                bottle_id = os.path.basename(embedding_file).replace(".npy", "")
-                self.id_to_index[bottle_id] = i
-                
-                # Load embedding and add to index
-                embedding = np.load(embedding_file)
-                if embedding.ndim == 1:
-                    embedding = embedding.reshape(1, -1)
-                
-                # Ensure embedding is normalized for cosine similarity
-                faiss.normalize_L2(embedding)
-                self.index.add(embedding)
-            
-            print(f"Loaded {self.index.ntotal} embeddings into FAISS index")
-        else:
+        # Load the embedding matrix and its bottle IDs if they exist
+        if not (os.path.exists(self.embeddings_file) and os.path.exists(self.ids_file)):
             print("No embeddings found. Please run preprocessing first.")
+            return
+        
+        embeddings = np.load(self.embeddings_file, mmap_mode='r' if mmap else None)
+        with open(self.ids_file, 'rb') as f:
+            index_to_id = orjson.loads(f.read())
+        if len(embeddings) != len(index_to_id):
+            print("Embeddings do not match saved bottle IDs. Please run preprocessing again.")
+            return
+        
+        self.embeddings = self._buffer = embeddings
+        self.index_to_id = index_to_id
+        self.id_to_index = {bottle_id: i for i, bottle_id in enumerate(index_to_id)}
+        
+        # Prefer the persisted FAISS index over rebuilding it
+        if not self.load_index(mmap=mmap):
+            self.index = self._build_index(self.embeddings)
+        
+        print(f"Loaded {len(self.embeddings)} embeddings")
     
     def add_bottle(self, bottle_id: str, name: str, features: np.ndarray, 
                   image_url: Optional[str] = None, save: bool = True):
@@ -100,39 +222,73 @@ class BottleDatabase:
             image_url: URL to bottle image
             save: Whether to save to disk immediately
         """
-        # Ensure features is 2D
+        self.add_bottles([bottle_id], [name], features, [image_url], save=save)
+    
+    def add_bottles(self, bottle_ids: List[str], names: List[str], features: np.ndarray,
+                    image_urls: Optional[List[Optional[str]]] = None, save: bool = True):
+        """
+        Add several bottles to the database at once.
+        
+        Args:
+            bottle_ids: Unique IDs for the bottles
+            names: Names of the bottles
+            features: Feature matrix from CLIP, one row per bottle
+            image_urls: URLs to bottle images
+            save: Whether to save to disk once all bottles are added
+        """
+        if image_urls is None:
+            image_urls = [None] * len(bottle_ids)
+        
+        # Ensure features is 2D float32
+        features = np.array(features, dtype=np.float32)
         if features.ndim == 1:
             features = features.reshape(1, -1)
         
         # Normalize features for cosine similarity
         faiss.normalize_L2(features)
         
-        # Add to FAISS index
-        self.index.add(features)
+        # Append to the embedding matrix, growing its storage geometrically
+        start = len(self.index_to_id)
+        end = start + len(features)
+        if end > len(self._buffer):
+            buffer = np.empty((max(1024, 2 * end), self.dimension), dtype=np.float32)
+            buffer[:start] = self._buffer[:start]
+            self._buffer = buffer
+        self._buffer[start:end] = features
+        self.embeddings = self._buffer[:end]
         
-        # Update mapping
-        idx = self.index.ntotal - 1
-        self.id_to_index[bottle_id] = idx
+        # Mapped inverted lists are read-only; load a private copy to append to
+        if self._mapped_index_file is not None:
+            self.index = faiss.read_index(self._mapped_index_file)
+            self._mapped_index_file = None
         
-        # Update metadata
-        self.metadata[bottle_id] = {
-            "name": name,
-            "image_url": image_url
-        }
+        # Add to FAISS index in one call
+        if self.index is not None:
+            self.index.add(self._index_input(self.index, features))
+        
+        # Update mapping and metadata
+        for idx, (bottle_id, name, image_url) in enumerate(zip(bottle_ids, names, image_urls), start):
+            self.id_to_index[bottle_id] = idx
+            self.index_to_id.append(bottle_id)
+            self.metadata[bottle_id] = {
+                "name": name,
+                "image_url": image_url
+            }
         
         # Save if requested
         if save:
-            self._save_bottle(bottle_id, features, idx)
+            self.save_embeddings()
     
-    def _save_bottle(self, bottle_id: str, features: np.ndarray, idx: int):
-        """Save bottle data to disk."""
-        # Save embedding
-        embedding_file = os.path.join(self.embeddings_dir, f"{bottle_id}.npy")
-        np.save(embedding_file, features)
+    def save_embeddings(self):
+        """Save the embedding matrix, bottle IDs, and metadata to disk."""
+        # Save embeddings as a single matrix with a parallel list of IDs
+        np.save(self.embeddings_file, self.embeddings)
+        with open(self.ids_file, 'wb') as f:
+            f.write(orjson.dumps(self.index_to_id))
         
         # Save updated metadata
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2)
+        with open(self.metadata_file, 'wb') as f:
+            f.write(orjson.dumps(self.metadata, option=orjson.OPT_INDENT_2))
     
     def find_matches(self, query_features: np.ndarray, top_k: int = 3, confidence_threshold: float = 0.0) -> List[Dict]:
         """
@@ -146,27 +302,28 @@ class BottleDatabase:
         Returns:
             List of BottleMatch objects
         """
-        if self.index.ntotal == 0:
+        if len(self.embeddings) == 0:
             return []
         
-        # Ensure query is 2D and normalized
+        # Ensure query is 2D float32 and normalized
+        query_features = np.array(query_features, dtype=np.float32)
         if query_features.ndim == 1:
             query_features = query_features.reshape(1, -1)
         faiss.normalize_L2(query_features)
         
         # Search index - retrieve more results than needed to apply threshold filtering
-        max_results = min(max(top_k * 3, 10), self.index.ntotal)  # Get more results to filter
-        D, I = self.index.search(query_features, max_results)
+        max_results = min(max(top_k * 3, 10), len(self.embeddings))  # Get more results to filter
+        if self.index is not None:
+            num_candidates = min(max_results * RERANK_FACTOR, len(self.embeddings))
+            _, I = self.index.search(self._index_input(self.index, query_features), num_candidates)
+            scores, indices = self._rerank(query_features[0], I[0], max_results)
+        else:
+            scores, indices = self._exact_search(query_features[0], max_results)
         
         # Convert to BottleMatch objects
         matches = []
-        for i, (distance, idx) in enumerate(zip(D[0], I[0])):
-            # Find bottle_id corresponding to idx
-            bottle_id = None
-            for bid, index in self.id_to_index.items():
-                if index == idx:
-                    bottle_id = bid
-                    break
+        for i, (distance, idx) in enumerate(zip(scores, indices)):
+            bottle_id = self.index_to_id[idx]
             
             if bottle_id and bottle_id in self.metadata:
                 # Convert cosine similarity (from -1 to 1) to confidence (from 0 to 1)
@@ -190,6 +347,44 @@ class BottleDatabase:
         
         return matches
     
+    def _exact_search(self, query: np.ndarray, k: int):
+        """
+        Score every bottle with a single matrix-vector product.
+        
+        Args:
+            query: Normalized query vector
+            k: Number of results to return
+            
+        Returns:
+            Tuple of (scores, row indices), best match first
+        """
+        scores = self.embeddings @ query
+        if k < len(scores):
+            indices = np.argpartition(scores, -k)[-k:]
+        else:
+            indices = np.arange(len(scores))
+        indices = indices[np.argsort(-scores[indices])]
+        return scores[indices], indices
+    
+    def _rerank(self, query: np.ndarray, candidates: np.ndarray, k: int):
+        """
+        Re-score approximate index candidates against the full-precision
+        embeddings so confidences are exact.
+        
+        Args:
+            query: Normalized query vector
+            candidates: Row indices returned by the index
+            k: Number of results to return
+            
+        Returns:
+            Tuple of (scores, row indices), best match first
+        """
+        # Approximate indexes pad missing results with -1
+        candidates = candidates[candidates >= 0]
+        scores = self.embeddings[candidates] @ query
+        order = np.argsort(-scores)[:k]
+        return scores[order], candidates[order]
+    
     def list_all_bottles(self) -> List[Dict]:
         """List all bottles in the database."""
         bottles = []
@@ -203,12 +398,47 @@ class BottleDatabase:
             bottles.append(bottle.to_dict())
         return bottles
     
-    def save_index(self, file_path: str = "data/faiss.index"):
+    def save_index(self, file_path: Optional[str] = None):
         """Save the FAISS index to disk."""
-        faiss.write_index(self.index, file_path)
+        file_path = file_path or self.index_file
+        if isinstance(self.index, faiss.IndexBinary):
+            faiss.write_index_binary(self.index, file_path)
+        elif self.index is not None:
+            faiss.write_index(self.index, file_path)
+        elif os.path.exists(file_path):
+            # Exact search needs no index; drop a stale one
+            os.remove(file_path)
     
-    def load_index(self, file_path: str = "data/faiss.index"):
-        """Load a FAISS index from disk."""
-        if os.path.exists(file_path):
-            self.index = faiss.read_index(file_path)
-            print(f"Loaded FAISS index with {self.index.ntotal} vectors") 
\ No newline at end of file
+    def load_index(self, file_path: Optional[str] = None, mmap: bool = False) -> bool:
+        """
+        Load a FAISS index from disk.
+        
+        Args:
+            file_path: Index file, defaults to the database's index file
+            mmap: Memory-map the index read-only instead of reading it into memory
+            
+        Returns:
+            True if an index matching the loaded embeddings was found
+        """
+        file_path = file_path or self.index_file
+        self._mapped_index_file = None
+        if not os.path.exists(file_path):
+            return False
+        
+        # The file decides the index kind, whatever index_type is configured
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        try:
+            index = faiss.read_index(file_path, io_flags)
+        except RuntimeError:
+            index = faiss.read_index_binary(file_path, io_flags)
+        if index.ntotal != len(self.embeddings):
+            print("FAISS index does not match saved embeddings, rebuilding")
+            return False
+        
+        self.index = index
+        print(f"Loaded FAISS index with {self.index.ntotal} vectors")
+        if mmap and isinstance(index, faiss.IndexIVF):
+            self._mapped_index_file = file_path
+        elif mmap:
+            print(f"Note: {type(index).__name__} cannot be memory-mapped; each worker holds its own copy")
+        return True
@@ -0,0 +1,54 @@
+import base64
+import binascii
+
+import orjson
+
+
+def decode_base64_body(body: bytes) -> bytes:
+    """
+    Decode a base64 image from a request body.
+
+    Accepts either a JSON object with a "base64_image" field or the bare
+    base64 text, each optionally prefixed with a data: URI header.
+    Whitespace and line breaks inside the base64 text are ignored; any
+    other character outside the base64 alphabet is rejected.
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        Decoded image bytes
+
+    Raises:
+        ValueError: If the body is not valid JSON, lacks the field, or is
+            empty or not base64
+    """
+    if body[:64].lstrip().startswith(b"{"):
+        try:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON body: {e}")
+        if not isinstance(data, dict) or not isinstance(data.get("base64_image"), str):
+            raise ValueError("Body must contain a base64_image string")
+        try:
+            payload = data["base64_image"].encode("ascii")
+        except UnicodeEncodeError:
+            raise ValueError("base64_image is not valid base64")
+    else:
+        payload = body
+
+    # Strip a "data:image/jpeg;base64," style prefix
+    payload = payload.lstrip()
+    if payload.startswith(b"data:"):
+        _, sep, payload = payload.partition(b",")
+        if not sep:
+            raise ValueError("Malformed data: URI")
+
+    payload = payload.translate(None, b" \t\r\n")
+    if not payload:
+        raise ValueError("base64_image is empty")
+
+    try:
+        return base64.b64decode(payload, validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"base64_image is not valid base64: {e}")
@@ -0,0 +1,70 @@
+import queue
+import threading
+
+_END = object()
+
+
+class PrefetchReader:
+    """
+    Iterates over a source in a background thread, keeping a bounded
+    queue of items ready so that loading overlaps with the consumer's work.
+    """
+
+    def __init__(self, source, transform=None, num_prefetch=2):
+        """
+        Initialize the reader.
+
+        Args:
+            source: Iterable to read items from
+            transform: Optional function applied to each item in the background thread
+            num_prefetch: Number of items to keep ready ahead of the consumer
+        """
+        self.source = source
+        self.transform = transform
+        self.num_prefetch = num_prefetch
+
+    def __len__(self):
+        return len(self.source)
+
+    def __iter__(self):
+        items = queue.Queue(maxsize=self.num_prefetch * 2)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(items, stop), daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is _END:
+                    return
+                yield item
+        finally:
+            # Let the producer exit if the consumer stops early
+            stop.set()
+            thread.join()
+
+    def _produce(self, items, stop):
+        """Read from the source and fill the queue until done or stopped."""
+        try:
+            for item in self.source:
+                if self.transform is not None:
+                    item = self.transform(item)
+                if not self._put(items, stop, (item, None)):
+                    return
+        except Exception as e:
+            self._put(items, stop, (None, e))
+            return
+        self._put(items, stop, (_END, None))
+
+    @staticmethod
+    def _put(items, stop, entry):
+        """Put an entry on the queue, giving up if the consumer has stopped."""
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False